@@ -0,0 +1,304 @@
+import logging
+import mmap
+import os
+import sys
+import tempfile
+from array import array
+from collections import defaultdict
+from pathlib import Path
+from typing import Collection, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.barchart import Barchart, Summarizer
+
+
+class _SpilledChunk:
+    """
+    A group of barcharts whose sample sizes and observations have been written to a memory-mapped file.
+
+    Each hotspot occupies one row of sample sizes followed by one row of observations per taxon.
+    Every row is PERIODS long, and every entry is stored as a 64 bit integer. The only data kept in
+    memory is a compact index: for each hotspot, its first row and an array of the ids its taxa have
+    in the taxon table shared by every chunk.
+    """
+    PERIODS = 48
+    TYPECODE = "q"
+    ID_TYPECODE = "i"
+    SMALL_INTS = range(-5, 257)
+
+    def __init__(self, barcharts: List["Barchart"], spill_dir: Path, taxon_ids: Dict[str, int]) -> None:
+        for bc in barcharts:
+            self._check_row_lengths(bc)
+        self.layout: Dict[str, Tuple[int, array]] = {}
+        fd, spill_name = tempfile.mkstemp(dir=spill_dir, prefix="chunk_", suffix=".bin")
+        self.spill_path = Path(spill_name)
+        try:
+            with os.fdopen(fd, "wb") as out_file:
+                row = 0
+                for bc in barcharts:
+                    self.layout[bc.loc_id] = (row, array(self.ID_TYPECODE, [taxon_ids[sp] for sp in bc.observations]))
+                    array(self.TYPECODE, bc.sample_sizes).tofile(out_file)
+                    for obs in bc.observations.values():
+                        array(self.TYPECODE, obs).tofile(out_file)
+                    row += len(bc.observations) + 1
+            with open(self.spill_path, "rb") as in_file:
+                self._map = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            self.spill_path.unlink()
+            raise
+        self._view = memoryview(self._map).cast(self.TYPECODE)
+        logging.info("Spilled %d barcharts to %s" % (len(barcharts), self.spill_path))
+
+    @classmethod
+    def _check_row_lengths(cls, barchart: "Barchart") -> None:
+        """Raises a ValueError if any of the supplied barchart's rows are not exactly PERIODS long."""
+        if len(barchart.sample_sizes) != cls.PERIODS:
+            raise ValueError(
+                f"{barchart.loc_id} has {len(barchart.sample_sizes)} sample sizes, expected {cls.PERIODS}."
+            )
+        for sp, obs in barchart.observations.items():
+            if len(obs) != cls.PERIODS:
+                raise ValueError(f"{barchart.loc_id} has {len(obs)} observations of {sp}, expected {cls.PERIODS}.")
+
+    @classmethod
+    def estimate_memory(cls, barchart: "Barchart") -> int:
+        """
+        Returns the approximate number of bytes a barchart occupies in memory before it is spilled.
+
+        Integers in Python's small int cache are shared rather than allocated, so only their pointers are counted.
+        """
+        def list_size(values: list) -> int:
+            return sys.getsizeof(values) + sum([sys.getsizeof(v) for v in values if v not in cls.SMALL_INTS])
+
+        size = sys.getsizeof(barchart.observations) + list_size(barchart.sample_sizes)
+        for sp, obs in barchart.observations.items():
+            size += sys.getsizeof(sp) + list_size(obs)
+        return size
+
+    def _sum_row(self, row: int, periods: List[int]) -> int:
+        """Sums a row over the specified periods, which must already have been checked by ChunkedSummarizer._check_periods."""
+        start = row * self.PERIODS
+        return sum([self._view[start + p] for p in periods])
+
+    def loc_ids(self) -> Iterator[str]:
+        return iter(self.layout)
+
+    def taxon_ids(self, loc_id: str) -> array:
+        return self.layout[loc_id][1]
+
+    def sample_total(self, loc_id: str, periods: List[int]) -> int:
+        """Returns the total number of samples for the supplied hotspot over the specified periods."""
+        return self._sum_row(self.layout[loc_id][0], periods)
+
+    def observation_totals(self, loc_id: str, periods: List[int]) -> Iterator[Tuple[int, int]]:
+        """Yields the id and total number of observations of each taxon at the supplied hotspot over the specified periods."""
+        sample_row, taxon_ids = self.layout[loc_id]
+        for offset, taxon_id in enumerate(taxon_ids, start=1):
+            yield taxon_id, self._sum_row(sample_row + offset, periods)
+
+    def close(self) -> None:
+        """Releases the memory map and deletes the spill file."""
+        self._view.release()
+        self._map.close()
+        self.spill_path.unlink(missing_ok=True)
+
+
+class ChunkedSummarizer:
+    """
+    An out-of-core counterpart to Summarizer, for summarizing more barcharts than fit comfortably in memory.
+
+    Barcharts are ingested from any iterable, and held in memory only until the barcharts waiting to be
+    spilled would exceed memory_budget bytes. They are then written as one chunk to a memory-mapped file
+    in spill_dir, and every query streams over the chunks. The budget does not cover barcharts the caller
+    keeps references to, such as those in a list passed to the constructor. Nor does it cover what stays
+    resident after spilling: one entry per distinct taxon in the shared taxon table, and a few bytes per
+    taxon per hotspot in each chunk's index.
+    """
+    DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024
+
+    def __init__(
+        self,
+        barcharts: Iterable["Barchart"],
+        name: Optional[str] = None,
+        memory_budget: int = DEFAULT_MEMORY_BUDGET,
+        spill_dir: Optional[Path] = None,
+    ) -> None:
+        if memory_budget <= 0:
+            raise ValueError(f"Memory budget must be a positive number of bytes: {memory_budget}")
+        self.name = name
+        self.memory_budget = memory_budget
+        self.closed = False
+        self._temp_dir = None
+        if spill_dir is None:
+            self._temp_dir = tempfile.TemporaryDirectory(prefix="ebird_bc_")
+            spill_dir = Path(self._temp_dir.name)
+        self.spill_dir = Path(spill_dir)
+        self.chunks: List["_SpilledChunk"] = []
+        self.hotspot_names: Dict[str, str] = {}
+        self.total_species: set = set()
+        self.total_other_taxa: set = set()
+        self._taxa: List[str] = []
+        self._taxon_ids: Dict[str, int] = {}
+        try:
+            self._ingest(barcharts)
+        except BaseException:
+            self.close()
+            raise
+        self.loc_ids = tuple(sorted(self.hotspot_names))
+        self.active_hotspots = set(self.loc_ids)
+
+    def _ingest(self, barcharts: Iterable["Barchart"]) -> None:
+        """Collects barcharts into chunks, spilling each chunk to disk once the memory budget would be exceeded."""
+        pending = []
+        pending_size = 0
+        for bc in barcharts:
+            if bc.loc_id in self.hotspot_names:
+                raise ValueError(f"Duplicate hotspot loc_id: {bc.loc_id}")
+            self.hotspot_names[bc.loc_id] = bc.name
+            for sp in bc.observations:
+                self._add_taxon(sp)
+            self.total_species.update(self._taxa[self._taxon_ids[sp]] for sp in bc.species)
+            self.total_other_taxa.update(self._taxa[self._taxon_ids[sp]] for sp in bc.other_taxa)
+            bc_size = _SpilledChunk.estimate_memory(bc)
+            if pending and pending_size + bc_size > self.memory_budget:
+                self._spill(pending)
+                pending = []
+                pending_size = 0
+            pending.append(bc)
+            pending_size += bc_size
+        if pending:
+            self._spill(pending)
+
+    def _add_taxon(self, sp: str) -> None:
+        """Adds a taxon to the shared taxon table, if it isn't already there."""
+        if sp not in self._taxon_ids:
+            self._taxon_ids[sp] = len(self._taxa)
+            self._taxa.append(sys.intern(sp))
+
+    def _spill(self, barcharts: List["Barchart"]) -> None:
+        self.chunks.append(_SpilledChunk(barcharts, self.spill_dir, self._taxon_ids))
+
+    @classmethod
+    def new_from_csv_paths(cls, csv_paths: Iterable[Path], **kwargs) -> "ChunkedSummarizer":
+        """Returns a ChunkedSummarizer populated from eBird CSVs, reading each file only when it is ingested."""
+        return cls((Barchart.new_from_csv(path) for path in csv_paths), **kwargs)
+
+    def _check_open(self) -> None:
+        if self.closed:
+            raise ValueError("ChunkedSummarizer is closed")
+
+    @staticmethod
+    def _check_periods(periods: List[int]) -> List[int]:
+        """
+        Returns the supplied periods with negative indices counted back from the last period, as a list would.
+
+        Raises an IndexError for any period outside the year.
+        """
+        checked = []
+        for p in periods:
+            if not -_SpilledChunk.PERIODS <= p < _SpilledChunk.PERIODS:
+                raise IndexError(f"Period out of range: {p}")
+            checked.append(p % _SpilledChunk.PERIODS)
+        return checked
+
+    def _active_chunk_hotspots(self) -> Iterator[Tuple["_SpilledChunk", str]]:
+        """Yields each active hotspot along with the chunk holding its data."""
+        self._check_open()
+        for chunk in self.chunks:
+            for hs in chunk.loc_ids():
+                if hs in self.active_hotspots:
+                    yield chunk, hs
+
+    def _active_taxa(self) -> set:
+        return {self._taxa[t] for chunk, hs in self._active_chunk_hotspots() for t in chunk.taxon_ids(hs)}
+
+    def _include_taxon(self, sp: str, include_sub_species: bool) -> bool:
+        return include_sub_species or sp in self.total_species
+
+    @property
+    def active_species(self) -> set:
+        return self._active_taxa() & self.total_species
+
+    @property
+    def active_other_taxa(self) -> set:
+        return self._active_taxa() & self.total_other_taxa
+
+    def set_hotspot_inactive(self, loc_id: str) -> None:
+        """Removes the supplied loc_id from the list of active hotspots."""
+        if loc_id not in self.loc_ids:
+            raise ValueError(f"Unrecognized hotspot loc_id: {loc_id}")
+        self.active_hotspots.discard(loc_id)
+
+    def set_hotspot_active(self, loc_id: str) -> None:
+        """Adds the supplied loc_id from the list of active hotspots."""
+        if loc_id not in self.loc_ids:
+            raise ValueError(f"Unrecognized hotspot loc_id: {loc_id}")
+        self.active_hotspots.add(loc_id)
+
+    def _observation_totals(
+        self, chunk: "_SpilledChunk", hs: str, periods: List[int], include_sub_species: bool
+    ) -> Iterator[Tuple[str, int]]:
+        """Yields the name and total number of observations of each included taxon at the supplied hotspot."""
+        for taxon_id, obs in chunk.observation_totals(hs, periods):
+            sp = self._taxa[taxon_id]
+            if self._include_taxon(sp, include_sub_species):
+                yield sp, obs
+
+    def summarize_period_total(self, periods: List[int], include_sub_species: bool = False) -> dict:
+        """Returns the cumulative sample sizes and observations of each taxon for each active hotspot."""
+        self._check_open()
+        periods = self._check_periods(periods)
+        sample_sizes = {}
+        observations = {}
+        for chunk, hs in self._active_chunk_hotspots():
+            sample_sizes[hs] = chunk.sample_total(hs, periods)
+            observations[hs] = dict(self._observation_totals(chunk, hs, periods, include_sub_species))
+        return {"samples": sample_sizes, "observations": observations}
+
+    def build_summary_dict(self, period_list: List[int], include_sub_species: bool = False) -> dict:
+        """
+        Returns a dictionary of observation data summarized to a single number per species for each active hotspot.
+        """
+        self._check_open()
+        period_list = self._check_periods(period_list)
+        summary_dict = {}
+        for chunk, hs in self._active_chunk_hotspots():
+            samples = chunk.sample_total(hs, period_list)
+            hs_summary = defaultdict(float)
+            for sp, obs in self._observation_totals(chunk, hs, period_list, include_sub_species):
+                hs_summary[sp] = Summarizer._combined_average([samples], [obs])
+            summary_dict[hs] = hs_summary
+        return summary_dict
+
+    def summarize_overall_odds(self, period_list: List[int], include_sub_species: bool = False) -> dict:
+        """Returns the odds of observing each taxon at one or more of the active hotspots over the specified periods."""
+        self._check_open()
+        period_list = self._check_periods(period_list)
+        inverse_odds = {}
+        for chunk, hs in self._active_chunk_hotspots():
+            samples = chunk.sample_total(hs, period_list)
+            for sp, obs in self._observation_totals(chunk, hs, period_list, include_sub_species):
+                odds = Summarizer._combined_average([samples], [obs])
+                inverse_odds[sp] = inverse_odds.get(sp, 1) * (1 - odds)
+        return {sp: round(1 - inverse, 5) for sp, inverse in inverse_odds.items()}
+
+    def close(self) -> None:
+        """Releases the memory maps, deletes this summarizer's spill files, and removes its temporary directory if it made one."""
+        for chunk in self.chunks:
+            chunk.close()
+        self.chunks = []
+        if self._temp_dir is not None:
+            self._temp_dir.cleanup()
+            self._temp_dir = None
+        self.closed = True
+
+    def __enter__(self) -> "ChunkedSummarizer":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self):
+        return len(self.loc_ids)
+
+    def __repr__(self) -> str:
+        return f"<ChunkedSummarizer for {len(self)} hotspots in {len(self.chunks)} chunks>"
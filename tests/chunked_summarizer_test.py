@@ -0,0 +1,222 @@
+import pytest
+
+from app import ebird_interface
+from app.barchart import Barchart, Summarizer
+from app.chunked_summarizer import ChunkedSummarizer, _SpilledChunk
+from pathlib import Path
+from typing import List
+
+
+TEST_DATA = Path(__file__).parent / "test_data"
+BC_PATHS = [
+    TEST_DATA / "ebird_L109516__1900_2021_1_12_barchart.txt",
+    TEST_DATA / "ebird_L351189__1900_2021_1_12_barchart.txt",
+    TEST_DATA / "ebird_L385839__1900_2021_1_12_barchart.txt",
+]
+HOTSPOT_NAMES = {
+    "L109516": "Prospect Park",
+    "L351189": "Calvert Vaux Park",
+    "L385839": "Salt Marsh Nature Center at Marine Park",
+}
+
+
+@pytest.fixture(autouse=True)
+def offline_hotspot_names(monkeypatch):
+    """Stands in for the eBird name lookup, so these tests don't need a network connection."""
+    monkeypatch.setattr(ebird_interface, "hotspot_name_from_loc_id", HOTSPOT_NAMES.get)
+
+
+@pytest.fixture
+def sample_barcharts() -> List["Barchart"]:
+    return [Barchart.new_from_csv(bc_file) for bc_file in BC_PATHS]
+
+
+@pytest.fixture
+def sample_summarizer(sample_barcharts: List["Barchart"]) -> "Summarizer":
+    return Summarizer(sample_barcharts, name="Sample Summarizer")
+
+
+@pytest.fixture
+def tiny_budget_summarizer(tmp_path: Path) -> "ChunkedSummarizer":
+    """A summarizer with a budget so small that every barchart is spilled to its own chunk."""
+    with ChunkedSummarizer.new_from_csv_paths(BC_PATHS, name="Tiny Budget", memory_budget=1, spill_dir=tmp_path) as summarizer:
+        yield summarizer
+
+
+@pytest.fixture
+def large_budget_summarizer(sample_barcharts: List["Barchart"]) -> "ChunkedSummarizer":
+    """A summarizer with a budget large enough to hold every barchart in a single chunk."""
+    with ChunkedSummarizer(sample_barcharts, name="Large Budget") as summarizer:
+        yield summarizer
+
+
+def test_bad_memory_budget(sample_barcharts: List["Barchart"]):
+    with pytest.raises(ValueError):
+        ChunkedSummarizer(sample_barcharts, memory_budget=0)
+
+
+def test_duplicate_hotspot(sample_barcharts: List["Barchart"]):
+    with pytest.raises(ValueError):
+        ChunkedSummarizer(sample_barcharts + sample_barcharts[:1])
+
+
+def test_spill_chunks(tiny_budget_summarizer: "ChunkedSummarizer", large_budget_summarizer: "ChunkedSummarizer", tmp_path: Path):
+    """Tests that a tiny budget spills every barchart separately, and a large budget keeps them together."""
+    assert len(tiny_budget_summarizer.chunks) == 3
+    assert len(list(tmp_path.glob("chunk_*.bin"))) == 3
+    assert len(large_budget_summarizer.chunks) == 1
+
+
+def test_budget_boundary(sample_barcharts: List["Barchart"]):
+    """Tests that a chunk is spilled only once the next barchart would push it over budget."""
+    budget = sum([_SpilledChunk.estimate_memory(bc) for bc in sample_barcharts[:2]])
+    with ChunkedSummarizer(sample_barcharts, memory_budget=budget) as summarizer:
+        assert len(summarizer.chunks) == 2
+
+
+def test_close_removes_spill_files(sample_barcharts: List["Barchart"]):
+    summarizer = ChunkedSummarizer(sample_barcharts, memory_budget=1)
+    spill_dir = summarizer.spill_dir
+    assert spill_dir.exists()
+    summarizer.close()
+    assert not spill_dir.exists()
+    assert not summarizer.chunks
+
+
+def test_close_removes_files_from_supplied_spill_dir(sample_barcharts: List["Barchart"], tmp_path: Path):
+    summarizer = ChunkedSummarizer(sample_barcharts, memory_budget=1, spill_dir=tmp_path)
+    assert len(list(tmp_path.glob("chunk_*.bin"))) == 3
+    summarizer.close()
+    assert tmp_path.exists()
+    assert not list(tmp_path.iterdir())
+
+
+def test_closed_summarizer(sample_barcharts: List["Barchart"]):
+    """Tests that queries on a closed summarizer raise an error rather than returning empty results."""
+    summarizer = ChunkedSummarizer(sample_barcharts, memory_budget=1)
+    summarizer.close()
+    assert summarizer.closed
+    with pytest.raises(ValueError):
+        summarizer.build_summary_dict(list(range(48)))
+    with pytest.raises(ValueError):
+        summarizer.summarize_period_total(list(range(48)))
+    with pytest.raises(ValueError):
+        summarizer.summarize_overall_odds(list(range(48)))
+    with pytest.raises(ValueError):
+        summarizer.active_species
+    with pytest.raises(ValueError):
+        summarizer.active_other_taxa
+    summarizer.close()
+
+
+def test_shared_spill_dir(sample_barcharts: List["Barchart"], sample_summarizer: "Summarizer", tmp_path: Path):
+    """Tests that two summarizers spilling to the same directory don't overwrite each other's files."""
+    periods = list(range(48))
+    with ChunkedSummarizer(sample_barcharts, memory_budget=1, spill_dir=tmp_path) as first:
+        with ChunkedSummarizer(sample_barcharts[:1], memory_budget=1, spill_dir=tmp_path) as second:
+            assert len(list(tmp_path.glob("chunk_*.bin"))) == 4
+            assert first.build_summary_dict(periods, include_sub_species=True) == sample_summarizer.build_summary_dict(periods)
+            assert second.build_summary_dict(periods)["L109516"]["Snow Goose"] == 0.02331
+        assert len(list(tmp_path.glob("chunk_*.bin"))) == 3
+        assert first.build_summary_dict(periods, include_sub_species=True) == sample_summarizer.build_summary_dict(periods)
+
+
+def test_short_rows(sample_barcharts: List["Barchart"], tmp_path: Path):
+    """Tests that rows without exactly one entry per period are rejected rather than misaligning the chunk."""
+    short_samples = sample_barcharts[0]
+    short_samples.sample_sizes = short_samples.sample_sizes[:40]
+    with pytest.raises(ValueError):
+        ChunkedSummarizer([short_samples], spill_dir=tmp_path)
+    short_obs = sample_barcharts[1]
+    short_obs.observations["Snow Goose"] = short_obs.observations["Snow Goose"][:40]
+    with pytest.raises(ValueError):
+        ChunkedSummarizer(sample_barcharts[1:], spill_dir=tmp_path)
+    assert not list(tmp_path.iterdir())
+
+
+def test_failed_ingest_cleanup(sample_barcharts: List["Barchart"], tmp_path: Path):
+    """Tests that chunks spilled before an ingestion error are closed and deleted."""
+    with pytest.raises(ValueError):
+        ChunkedSummarizer(sample_barcharts + sample_barcharts[:1], memory_budget=1, spill_dir=tmp_path)
+    assert not list(tmp_path.iterdir())
+    with pytest.raises(FileNotFoundError):
+        ChunkedSummarizer.new_from_csv_paths(BC_PATHS + [TEST_DATA / "missing.txt"], memory_budget=1, spill_dir=tmp_path)
+    assert not list(tmp_path.iterdir())
+
+
+def test_chunked_data_shape(tiny_budget_summarizer: "ChunkedSummarizer", sample_summarizer: "Summarizer"):
+    assert len(tiny_budget_summarizer) == 3
+    assert tiny_budget_summarizer.loc_ids == sample_summarizer.loc_ids
+    assert tiny_budget_summarizer.hotspot_names == sample_summarizer.hotspot_names
+    assert tiny_budget_summarizer.total_species == sample_summarizer.total_species
+    assert tiny_budget_summarizer.total_other_taxa == sample_summarizer.total_other_taxa
+    assert len(tiny_budget_summarizer.total_species) == 312
+    assert len(tiny_budget_summarizer.total_other_taxa) == 93
+
+
+def test_chunked_period_total(tiny_budget_summarizer: "ChunkedSummarizer"):
+    totals = tiny_budget_summarizer.summarize_period_total([0, 47], include_sub_species=True)
+    assert totals["samples"]["L109516"] == 601 + 363
+    assert totals["observations"]["L109516"]["Snow Goose"] == 32 + 35
+    assert totals["observations"]["L109516"]["bird sp."] == 2 + 1
+    species_only = tiny_budget_summarizer.summarize_period_total([0, 47])
+    assert "bird sp." not in species_only["observations"]["L109516"]
+
+
+@pytest.mark.parametrize("periods", [list(range(48)), list(range(12, 20)), list(range(24, 32)), [46, 47, 0, 1]])
+def test_chunked_summary_matches_summarizer(
+    tiny_budget_summarizer: "ChunkedSummarizer",
+    large_budget_summarizer: "ChunkedSummarizer",
+    sample_summarizer: "Summarizer",
+    periods: List[int],
+):
+    """Tests that streaming over spilled chunks gives the same averages as the in-memory Summarizer."""
+    expected = sample_summarizer.build_summary_dict(periods)
+    assert tiny_budget_summarizer.build_summary_dict(periods, include_sub_species=True) == expected
+    assert large_budget_summarizer.build_summary_dict(periods, include_sub_species=True) == expected
+
+
+def test_chunked_period_bounds(tiny_budget_summarizer: "ChunkedSummarizer", sample_summarizer: "Summarizer"):
+    """Tests that periods are indexed the way the in-memory Summarizer indexes them, rather than reading other rows."""
+    assert tiny_budget_summarizer.build_summary_dict([-1], include_sub_species=True) == sample_summarizer.build_summary_dict([-1])
+    assert tiny_budget_summarizer.build_summary_dict([-48, -1], include_sub_species=True) == sample_summarizer.build_summary_dict([0, 47])
+    assert tiny_budget_summarizer.summarize_period_total([-1])["samples"]["L109516"] == 363
+    assert tiny_budget_summarizer.summarize_overall_odds([-1])["Snow Goose"] <= 1
+    for bad_period in (48, -49):
+        with pytest.raises(IndexError):
+            sample_summarizer.build_summary_dict([bad_period])
+        with pytest.raises(IndexError):
+            tiny_budget_summarizer.build_summary_dict([bad_period])
+        with pytest.raises(IndexError):
+            tiny_budget_summarizer.summarize_period_total([bad_period])
+        with pytest.raises(IndexError):
+            tiny_budget_summarizer.summarize_overall_odds([bad_period])
+
+
+def test_chunked_summary_values(tiny_budget_summarizer: "ChunkedSummarizer"):
+    whole_year = tiny_budget_summarizer.build_summary_dict(list(range(48)))
+    assert whole_year["L109516"]["Snow Goose"] == 0.02331
+    assert whole_year["L351189"]["Magnolia Warbler"] == 0.08875
+    assert whole_year["L385839"]["Northern Cardinal"] == 0.50819
+    assert "bird sp." not in whole_year["L109516"]
+
+
+def test_chunked_hotspot_activation(tiny_budget_summarizer: "ChunkedSummarizer"):
+    pp_only_species = "Swainson's Warbler"
+    assert pp_only_species in tiny_budget_summarizer.active_species
+    tiny_budget_summarizer.set_hotspot_inactive("L109516")
+    assert pp_only_species not in tiny_budget_summarizer.active_species
+    assert "L109516" not in tiny_budget_summarizer.build_summary_dict(list(range(48)))
+    tiny_budget_summarizer.set_hotspot_active("L109516")
+    assert pp_only_species in tiny_budget_summarizer.active_species
+    with pytest.raises(ValueError):
+        tiny_budget_summarizer.set_hotspot_active("Bad Hotspot")
+    with pytest.raises(ValueError):
+        tiny_budget_summarizer.set_hotspot_inactive("Bad Hotspot")
+
+
+def test_chunked_overall_odds(tiny_budget_summarizer: "ChunkedSummarizer"):
+    """Makes sure the overall odds for a species changes when a hotspot is turned off."""
+    assert tiny_budget_summarizer.summarize_overall_odds(list(range(48)))["Snow Goose"] == 0.05497
+    tiny_budget_summarizer.set_hotspot_inactive("L109516")
+    assert tiny_budget_summarizer.summarize_overall_odds(list(range(48)))["Snow Goose"] == 0.03241